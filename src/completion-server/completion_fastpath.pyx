@@ -0,0 +1,42 @@
+# cython: language_level=3
+"""
+补全热路径的 Cython 版本
+
+与 server.py 中的纯 Python 实现逐行对应。用
+`python setup.py build_ext --inplace` 编译后，server.py 会自动
+改用这里的编译版；没有编译产物时继续用纯 Python 实现，接口不变。
+"""
+
+
+cpdef tuple split_at_cursor(str content, int line, int col):
+    """在光标处切分文件内容为 (prefix, suffix)"""
+    cdef Py_ssize_t pos = 0
+    cdef Py_ssize_t nl, line_end, offset
+    cdef int i
+
+    for i in range(line):
+        nl = content.find('\n', pos)
+        if nl == -1:
+            break
+        pos = nl + 1
+    # 列号不能超出当前行的长度
+    line_end = content.find('\n', pos)
+    if line_end == -1:
+        line_end = len(content)
+    offset = pos + col
+    if offset > line_end:
+        offset = line_end
+    return content[:offset], content[offset:]
+
+
+cpdef str clean_completion(str completion):
+    """清理补全结果（剥掉模型偶尔带上的 markdown 代码围栏）"""
+    cdef Py_ssize_t nl
+
+    completion = completion.strip()
+    if "```" not in completion:
+        return completion
+    if completion.startswith("```"):
+        nl = completion.find("\n")
+        completion = completion[nl + 1:] if nl != -1 else ""
+    return completion.removesuffix("```").strip()
@@ -4,14 +4,41 @@ MindCode Completion Server - AI 驱动版
 """
 
 import os
+import re
 import time
+import array
 import asyncio
+import functools
+import hashlib
+import logging
+from collections import OrderedDict
+
 import httpx
 from typing import List, Optional, Tuple
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
+# orjson 的 C 序列化器比标准库 json 快 3-5 倍，未安装时回退到标准库
+try:
+    import orjson
+
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    import json
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    _json_loads = json.loads
+
+# 日志 - 惰性 %s 格式化：级别关闭时连格式串都不会构建，
+# 也不再在事件循环里无条件刷 stdout
+logger = logging.getLogger("completion")
+
 # ============================================================================
 # 配置 - 所有密钥从环境变量读取，禁止硬编码
 # ============================================================================
@@ -34,6 +61,14 @@ CLAUDE_MODEL_BLOCK = "claude-sonnet-4-5-20250929"
 # 补全参数
 MAX_TOKENS_INLINE = 200   # inline 模式：单行补全
 MAX_TOKENS_BLOCK = 1024   # block 模式：多行代码生成
+# 语句刚结束时跳过补全（设为 0 关闭）
+AGGRESSIVE_SKIP = os.environ.get("MINDCODE_AGGRESSIVE_SKIP", "1") != "0"
+# 发送给 LLM 的上下文上限（字符数）- 大文件整发会显著拉高上传量和上游首 token 延迟
+MAX_PREFIX_CHARS = int(os.environ.get("MINDCODE_MAX_PREFIX_CHARS", "4000"))
+MAX_SUFFIX_CHARS = int(os.environ.get("MINDCODE_MAX_SUFFIX_CHARS", "1000"))
+# 对冲请求：主 provider 发出 N 毫秒仍未返回时，向备用 provider 跟发一份，
+# 取先到的结果（压尾延迟）。0 = 关闭
+HEDGE_MS = int(os.environ.get("MINDCODE_HEDGE_MS", "0"))
 TEMPERATURE = 0.0  # 低温度 = 更确定性的输出
 TIMEOUT = 30.0  # API 超时时间（秒）- Claude 稍慢，给多点时间
 
@@ -80,6 +115,8 @@ start_time = time.time()
 app = FastAPI(
     title="MindCode Completion Server",
     version="2.0.0",
+    # orjson 直接输出 bytes，比标准库 json 序列化快约 3 倍
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse,
 )
 
 # CORS 配置
@@ -91,54 +128,235 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# HTTP 客户端
-http_client = httpx.AsyncClient(timeout=TIMEOUT)
+# HTTP 客户端 - HTTP/2 多路复用 + 连接池，避免打字高峰时排队等 TLS 握手。
+# 在 startup 事件中创建：多 worker 部署时每个进程各持有自己的连接池
+http_client: Optional[httpx.AsyncClient] = None
+
+
+@app.on_event("startup")
+async def create_http_client():
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=TIMEOUT,
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=50,
+            keepalive_expiry=60.0,
+        ),
+    )
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
+# 预构建的请求头 - 密钥在启动后不变，没必要每次请求都重建 dict
+_DEEPSEEK_HEADERS = {
+    "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+    "Content-Type": "application/json",
+}
+_CLAUDE_HEADERS = {
+    "x-api-key": CLAUDE_API_KEY,
+    "anthropic-version": "2023-06-01",
+    "Content-Type": "application/json",
+}
+
+# 每次请求都不变的 URL / 停止序列 / 按模式的参数表，在导入时算好
+_DEEPSEEK_URL = f"{DEEPSEEK_BASE_URL}/v1/chat/completions"
+_CLAUDE_URL = f"{CLAUDE_BASE_URL}/v1/messages"
+_DEEPSEEK_STOP_BLOCK = ["```", "<CURSOR>"]
+_DEEPSEEK_STOP_INLINE = ["\n\n", "```", "<CURSOR>"]
+_MAX_BY_MODE = {"block": MAX_TOKENS_BLOCK, "inline": MAX_TOKENS_INLINE}
+_CLAUDE_MODEL_BY_MODE = {"block": CLAUDE_MODEL_BLOCK, "inline": CLAUDE_MODEL_INLINE}
+
+
+# ============================================================================
+# Completion Cache
+# ============================================================================
+
+# LRU 补全缓存 - 命中时完全省掉上游 API 调用（最大的单项成本）
+_CACHE_MAX_ENTRIES = 512
+_completion_cache: "OrderedDict[bytes, str]" = OrderedDict()
+
+
+def _cache_key(mode: str, language: str, prefix: str, suffix: str) -> bytes:
+    """缓存键：光标附近的上下文足以区分补全，不必哈希整个文件"""
+    raw = f"{mode}|{language}|{prefix[-512:]}|{suffix[:256]}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest()
+
+
+def _cache_get(key: bytes) -> Optional[str]:
+    completion = _completion_cache.get(key)
+    if completion is not None:
+        _completion_cache.move_to_end(key)
+    return completion
+
+
+def _cache_put(key: bytes, completion: str) -> None:
+    _completion_cache[key] = completion
+    _completion_cache.move_to_end(key)
+    while len(_completion_cache) > _CACHE_MAX_ENTRIES:
+        _completion_cache.popitem(last=False)
+
+
+# 在途请求合并 - 快速打字时 IDE 会对同一上下文连发请求，
+# 后到的请求直接等待已发出的那一次上游调用，不再重复开火
+_inflight: "dict[bytes, asyncio.Future]" = {}
 
 
 # ============================================================================
 # AI Completion Logic
 # ============================================================================
 
+# 扩展名 -> 语言映射（构建一次，单次 dict 查找代替逐个 endswith 扫描）
+_EXT_MAP = {
+    '.py': 'python', '.js': 'javascript', '.ts': 'typescript',
+    '.tsx': 'typescript', '.jsx': 'javascript', '.c': 'c',
+    '.cpp': 'cpp', '.h': 'c', '.hpp': 'cpp', '.java': 'java',
+    '.go': 'go', '.rs': 'rust', '.rb': 'ruby', '.php': 'php',
+    '.cs': 'csharp', '.swift': 'swift', '.kt': 'kotlin',
+    '.html': 'html', '.css': 'css', '.json': 'json',
+    '.md': 'markdown', '.sql': 'sql', '.sh': 'shell',
+}
+
+
+# 复杂结构关键词 - 编译成单个正则，一次扫描代替 12+ 次子串搜索
+_COMPLEX_RE = re.compile(
+    '|'.join(re.escape(kw) for kw in [
+        '链表', '树', '栈', '队列', '图', 'linked list', 'tree', 'stack',
+        'queue', 'graph', 'struct', 'class', '实现', 'implement',
+    ]),
+    re.IGNORECASE,
+)
+
+
+@functools.lru_cache(maxsize=1024)
 def get_language_from_path(file_path: str) -> str:
-    """根据文件路径获取语言"""
-    ext_map = {
-        '.py': 'python', '.js': 'javascript', '.ts': 'typescript',
-        '.tsx': 'typescript', '.jsx': 'javascript', '.c': 'c',
-        '.cpp': 'cpp', '.h': 'c', '.hpp': 'cpp', '.java': 'java',
-        '.go': 'go', '.rs': 'rust', '.rb': 'ruby', '.php': 'php',
-        '.cs': 'csharp', '.swift': 'swift', '.kt': 'kotlin',
-        '.html': 'html', '.css': 'css', '.json': 'json',
-        '.md': 'markdown', '.sql': 'sql', '.sh': 'shell',
-    }
-    for ext, lang in ext_map.items():
-        if file_path.lower().endswith(ext):
-            return lang
-    return 'text'
+    """根据文件路径获取语言（按路径缓存，同一文件反复编辑时零开销）"""
+    ext = os.path.splitext(file_path)[1].lower()
+    return _EXT_MAP.get(ext, 'text')
 
 
-def build_fim_prompt(prefix: str, suffix: str, language: str, mode: str) -> Tuple[str, str]:
-    """
-    构建 FIM (Fill-In-the-Middle) 格式的 prompt
-    mode: 'inline' 或 'block'
+def _split_at_cursor(content: str, line: int, col: int) -> Tuple[str, str]:
+    """在光标处切分文件内容为 (prefix, suffix)
+
+    用 str.find 定位光标所在行的字节偏移后直接切片，
+    避免 split('\\n') + join 把整个文件复制两遍。
     """
-    # 系统提示 - 根据模式调整
+    pos = 0
+    for _ in range(line):
+        nl = content.find('\n', pos)
+        if nl == -1:
+            break
+        pos = nl + 1
+    # 列号不能超出当前行的长度
+    line_end = content.find('\n', pos)
+    if line_end == -1:
+        line_end = len(content)
+    offset = min(pos + col, line_end)
+    return content[:offset], content[offset:]
+
+
+# 行起始偏移缓存 - 连续按键时编辑器会对同一份文件内容反复请求（只有光标在动），
+# 换行扫描按内容哈希复用。小文件直接线性扫描，建表不划算
+_LINE_OFFSETS_MIN_SIZE = 16 * 1024
+_LINE_OFFSETS_MAX_ENTRIES = 32
+_line_offsets_cache: "OrderedDict[bytes, array.array]" = OrderedDict()
+
+
+def _build_line_offsets(content: str) -> array.array:
+    offsets = array.array('q', [0])
+    pos = 0
+    while True:
+        nl = content.find('\n', pos)
+        if nl == -1:
+            break
+        pos = nl + 1
+        offsets.append(pos)
+    return offsets
+
+
+def _split_at_cursor_cached(content: str, line: int, col: int) -> Tuple[str, str]:
+    """_split_at_cursor 的带缓存版本：大文件按内容哈希复用行偏移表，O(1) 定位光标"""
+    if len(content) < _LINE_OFFSETS_MIN_SIZE:
+        return _split_at_cursor(content, line, col)
+
+    key = hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+    offsets = _line_offsets_cache.get(key)
+    if offsets is None:
+        offsets = _build_line_offsets(content)
+        _line_offsets_cache[key] = offsets
+        while len(_line_offsets_cache) > _LINE_OFFSETS_MAX_ENTRIES:
+            _line_offsets_cache.popitem(last=False)
+    else:
+        _line_offsets_cache.move_to_end(key)
+
+    if line >= len(offsets):
+        line = len(offsets) - 1
+    pos = offsets[line]
+    line_end = offsets[line + 1] - 1 if line + 1 < len(offsets) else len(content)
+    offset = min(pos + col, line_end)
+    return content[:offset], content[offset:]
+
+
+@functools.lru_cache(maxsize=64)
+def _system_prompt(language: str, mode: str) -> str:
+    """系统提示 - 只随 (language, mode) 变化，缓存后每个组合只构建一次"""
     if mode == "block":
-        system_prompt = f"""You are an expert {language} programmer. Generate complete, working code.
+        return f"""You are an expert {language} programmer. Generate complete, working code.
 Rules:
 - Output ONLY the code, no explanations or markdown
 - When the comment describes a data structure (like linked list, tree, etc.), implement the complete structure with all common operations
 - Include necessary struct/class definitions
 - Match the existing code style and indentation
 - Generate production-ready code"""
-    else:
-        system_prompt = f"""You are an expert {language} programmer. Complete the code at the cursor position.
+    return f"""You are an expert {language} programmer. Complete the code at the cursor position.
 Rules:
 - Output ONLY the code to insert, no explanations
 - Match the existing code style and indentation
 - Keep completions concise (single line preferred)
 - If completing a comment, generate the described code"""
 
-    # 用户提示
+
+def _trim_context(prefix: str, suffix: str) -> Tuple[str, str]:
+    """把发送给 LLM 的上下文裁剪到配置上限，并对齐到行边界
+
+    prefix 保留靠近光标的尾部并丢掉截断产生的半行，
+    suffix 保留靠近光标的头部并在最后一个完整行处截断。
+    """
+    if len(prefix) > MAX_PREFIX_CHARS:
+        prefix = prefix[-MAX_PREFIX_CHARS:]
+        nl = prefix.find('\n')
+        if nl != -1:
+            prefix = prefix[nl + 1:]
+    if len(suffix) > MAX_SUFFIX_CHARS:
+        suffix = suffix[:MAX_SUFFIX_CHARS]
+        nl = suffix.rfind('\n')
+        if nl != -1:
+            suffix = suffix[:nl]
+    return prefix, suffix
+
+
+def _is_trivial_context(prefix: str) -> bool:
+    """判断光标处是否明显无需补全
+
+    保守启发式：光标前一个字符是空白，且最后一个非空行以语句结束符
+    （';'、'}'、')'）收尾 —— 上一条语句刚写完、新行还没有内容，
+    这时调 LLM 几乎必然得到空补全。冒号不算：def/if 之后正是要补全的地方。
+    """
+    if not prefix or not prefix[-1].isspace():
+        return False
+    stripped = prefix.rstrip()
+    return bool(stripped) and stripped[-1] in ';})'
+
+
+def build_fim_prompt(prefix: str, suffix: str, language: str, mode: str) -> Tuple[str, str]:
+    """
+    构建 FIM (Fill-In-the-Middle) 格式的 prompt
+    mode: 'inline' 或 'block'
+    """
     user_prompt = f"""Complete the code at <CURSOR>:
 
 ```{language}
@@ -147,63 +365,61 @@ Rules:
 
 Output only the code to insert:"""
 
-    return system_prompt, user_prompt
+    return _system_prompt(language, mode), user_prompt
 
 
 async def call_deepseek_api(system_prompt: str, user_prompt: str, mode: str = "inline") -> Optional[str]:
     """调用 DeepSeek API 进行补全"""
-    max_tokens = MAX_TOKENS_BLOCK if mode == "block" else MAX_TOKENS_INLINE
-    stop_sequences = ["```", "<CURSOR>"] if mode == "block" else ["\n\n", "```", "<CURSOR>"]
+    max_tokens = _MAX_BY_MODE.get(mode, MAX_TOKENS_INLINE)
+    stop_sequences = _DEEPSEEK_STOP_BLOCK if mode == "block" else _DEEPSEEK_STOP_INLINE
 
     try:
+        payload = {
+            "model": DEEPSEEK_MODEL,
+            "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+            "max_tokens": max_tokens, "temperature": TEMPERATURE, "stop": stop_sequences,
+        }
         response = await http_client.post(
-            f"{DEEPSEEK_BASE_URL}/v1/chat/completions",
-            headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"},
-            json={
-                "model": DEEPSEEK_MODEL,
-                "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                "max_tokens": max_tokens, "temperature": TEMPERATURE, "stop": stop_sequences,
-            },
+            _DEEPSEEK_URL,
+            headers=_DEEPSEEK_HEADERS,
+            content=_json_dumps(payload),
         )
         if response.status_code != 200:
-            print(f"[DeepSeek] API 错误: {response.status_code} - {response.text}")
+            logger.error("[DeepSeek] API 错误: %s - %s", response.status_code, response.text)
             return None
-        data = response.json()
+        data = _json_loads(response.content)
         completion = data.get("choices", [{}])[0].get("message", {}).get("content", "")
         return clean_completion(completion)
     except httpx.TimeoutException:
-        print("[DeepSeek] 请求超时")
+        logger.warning("[DeepSeek] 请求超时")
         return None
     except Exception as e:
-        print(f"[DeepSeek] 请求异常: {e}")
+        logger.error("[DeepSeek] 请求异常: %s", e)
         return None
 
 
 async def call_claude_api(system_prompt: str, user_prompt: str, mode: str = "inline") -> Optional[str]:
     """调用 Claude (Codesuc) API 进行补全 - Anthropic 原生格式"""
-    max_tokens = MAX_TOKENS_BLOCK if mode == "block" else MAX_TOKENS_INLINE
-    model = CLAUDE_MODEL_BLOCK if mode == "block" else CLAUDE_MODEL_INLINE
-    print(f"[Claude] 使用模型: {model}")
+    max_tokens = _MAX_BY_MODE.get(mode, MAX_TOKENS_INLINE)
+    model = _CLAUDE_MODEL_BY_MODE.get(mode, CLAUDE_MODEL_INLINE)
+    logger.debug("[Claude] 使用模型: %s", model)
 
     try:
+        payload = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "system": [{"type": "text", "text": system_prompt}],  # Anthropic 要求数组格式
+            "messages": [{"role": "user", "content": user_prompt}],
+        }
         response = await http_client.post(
-            f"{CLAUDE_BASE_URL}/v1/messages",
-            headers={
-                "x-api-key": CLAUDE_API_KEY,
-                "anthropic-version": "2023-06-01",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": model,
-                "max_tokens": max_tokens,
-                "system": [{"type": "text", "text": system_prompt}],  # Anthropic 要求数组格式
-                "messages": [{"role": "user", "content": user_prompt}],
-            },
+            _CLAUDE_URL,
+            headers=_CLAUDE_HEADERS,
+            content=_json_dumps(payload),
         )
         if response.status_code != 200:
-            print(f"[Claude] API 错误: {response.status_code} - {response.text}")
+            logger.error("[Claude] API 错误: %s - %s", response.status_code, response.text)
             return None
-        data = response.json()
+        data = _json_loads(response.content)
         # Anthropic 格式: content 是数组
         content_blocks = data.get("content", [])
         completion = ""
@@ -212,22 +428,73 @@ async def call_claude_api(system_prompt: str, user_prompt: str, mode: str = "inl
                 completion += block.get("text", "")
         return clean_completion(completion)
     except httpx.TimeoutException:
-        print("[Claude] 请求超时")
+        logger.warning("[Claude] 请求超时")
         return None
     except Exception as e:
-        print(f"[Claude] 请求异常: {e}")
+        logger.error("[Claude] 请求异常: %s", e)
         return None
 
 
 def clean_completion(completion: str) -> str:
-    """清理补全结果"""
+    """清理补全结果（剥掉模型偶尔带上的 markdown 代码围栏）"""
     completion = completion.strip()
+    # 常见情况：模型遵守了 "no markdown"，直接返回
+    if "```" not in completion:
+        return completion
     if completion.startswith("```"):
-        lines = completion.split("\n")
-        completion = "\n".join(lines[1:])
-    if completion.endswith("```"):
-        completion = completion[:-3]
-    return completion.strip()
+        # 丢掉围栏行本身，不必 split 出整个行列表
+        nl = completion.find("\n")
+        completion = completion[nl + 1:] if nl != -1 else ""
+    return completion.removesuffix("```").strip()
+
+
+# 可选的 Cython 快速路径 - 有编译产物时覆盖上面两个纯 Python 热路径函数
+# （python setup.py build_ext --inplace，见 completion_fastpath.pyx）
+try:
+    from completion_fastpath import (  # type: ignore  # noqa: F811
+        clean_completion,
+        split_at_cursor as _split_at_cursor,
+    )
+    logger.info("已启用 completion_fastpath 编译版热路径")
+except ImportError:
+    pass
+
+
+async def _call_provider(provider: str, system_prompt: str, user_prompt: str, mode: str) -> Optional[str]:
+    if provider == "claude":
+        return await call_claude_api(system_prompt, user_prompt, mode)
+    return await call_deepseek_api(system_prompt, user_prompt, mode)
+
+
+async def _hedged_call(primary: str, system_prompt: str, user_prompt: str,
+                       mode: str, delay: float) -> Optional[str]:
+    """对冲请求：主 provider 先发，delay 秒后备用 provider 跟进
+
+    返回先到的非 None 结果并取消另一路。上游偶发卡顿时把 p99 压到
+    接近 p50，代价是少量重复请求。
+    """
+    fallback = "deepseek" if primary == "claude" else "claude"
+
+    async def _late_fallback() -> Optional[str]:
+        await asyncio.sleep(delay)
+        logger.debug("[对冲] 主 provider 超过 %.0fms，跟发 %s", delay * 1000, fallback.upper())
+        return await _call_provider(fallback, system_prompt, user_prompt, mode)
+
+    pending = {
+        asyncio.create_task(_call_provider(primary, system_prompt, user_prompt, mode)),
+        asyncio.create_task(_late_fallback()),
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                completion = task.result()
+                if completion is not None:
+                    return completion
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
 
 
 async def call_ai_api(system_prompt: str, user_prompt: str, mode: str = "inline") -> Optional[str]:
@@ -235,16 +502,99 @@ async def call_ai_api(system_prompt: str, user_prompt: str, mode: str = "inline"
     if mode == "block":
         # block 模式：用 Claude（智能）
         provider = AI_PROVIDER_BLOCK
-        print(f"[混合模式] block -> {provider.upper()}")
+        logger.debug("[混合模式] block -> %s", provider.upper())
     else:
         # inline 模式：用 DeepSeek（快）
         provider = AI_PROVIDER_INLINE
-        print(f"[混合模式] inline -> {provider.upper()}")
+        logger.debug("[混合模式] inline -> %s", provider.upper())
+
+    if HEDGE_MS > 0:
+        return await _hedged_call(provider, system_prompt, user_prompt, mode, HEDGE_MS / 1000.0)
+    return await _call_provider(provider, system_prompt, user_prompt, mode)
+
 
+async def call_deepseek_api_stream(system_prompt: str, user_prompt: str, mode: str = "inline"):
+    """调用 DeepSeek API 流式补全（SSE），逐段产出文本增量"""
+    max_tokens = _MAX_BY_MODE.get(mode, MAX_TOKENS_INLINE)
+    stop_sequences = _DEEPSEEK_STOP_BLOCK if mode == "block" else _DEEPSEEK_STOP_INLINE
+
+    payload = {
+        "model": DEEPSEEK_MODEL,
+        "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+        "max_tokens": max_tokens, "temperature": TEMPERATURE, "stop": stop_sequences,
+        "stream": True,
+    }
+    try:
+        async with http_client.stream(
+            "POST",
+            _DEEPSEEK_URL,
+            headers=_DEEPSEEK_HEADERS,
+            content=_json_dumps(payload),
+        ) as response:
+            if response.status_code != 200:
+                logger.error("[DeepSeek] API 错误: %s", response.status_code)
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data_str = line[6:]
+                if data_str == "[DONE]":
+                    break
+                chunk = _json_loads(data_str)
+                delta = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    except httpx.TimeoutException:
+        logger.warning("[DeepSeek] 流式请求超时")
+    except Exception as e:
+        logger.error("[DeepSeek] 流式请求异常: %s", e)
+
+
+async def call_claude_api_stream(system_prompt: str, user_prompt: str, mode: str = "inline"):
+    """调用 Claude API 流式补全（SSE），逐段产出文本增量"""
+    max_tokens = _MAX_BY_MODE.get(mode, MAX_TOKENS_INLINE)
+    model = _CLAUDE_MODEL_BY_MODE.get(mode, CLAUDE_MODEL_INLINE)
+
+    payload = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": [{"type": "text", "text": system_prompt}],
+        "messages": [{"role": "user", "content": user_prompt}],
+        "stream": True,
+    }
+    try:
+        async with http_client.stream(
+            "POST",
+            _CLAUDE_URL,
+            headers=_CLAUDE_HEADERS,
+            content=_json_dumps(payload),
+        ) as response:
+            if response.status_code != 200:
+                logger.error("[Claude] API 错误: %s", response.status_code)
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = _json_loads(line[6:])
+                if event.get("type") == "content_block_delta":
+                    delta = event.get("delta", {}).get("text")
+                    if delta:
+                        yield delta
+    except httpx.TimeoutException:
+        logger.warning("[Claude] 流式请求超时")
+    except Exception as e:
+        logger.error("[Claude] 流式请求异常: %s", e)
+
+
+async def call_ai_api_stream(system_prompt: str, user_prompt: str, mode: str = "inline"):
+    """根据模式调用对应 AI API 的流式版本"""
+    provider = AI_PROVIDER_BLOCK if mode == "block" else AI_PROVIDER_INLINE
     if provider == "claude":
-        return await call_claude_api(system_prompt, user_prompt, mode)
+        agen = call_claude_api_stream(system_prompt, user_prompt, mode)
     else:
-        return await call_deepseek_api(system_prompt, user_prompt, mode)
+        agen = call_deepseek_api_stream(system_prompt, user_prompt, mode)
+    async for delta in agen:
+        yield delta
 
 
 # ============================================================================
@@ -274,40 +624,63 @@ async def get_stats():
     }
 
 
+async def _sse_done():
+    """空 SSE 流 - 用于流式请求的跳过路径"""
+    yield b"data: [DONE]\n\n"
+
+
+async def _completion_event_stream(cache_key: bytes, system_prompt: str, user_prompt: str, mode: str):
+    """SSE 事件流：逐段转发上游增量，结束后写入缓存并发送 [DONE]"""
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        yield b"data: " + _json_dumps({"delta": cached, "cached": True}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+        return
+
+    # 增量攒在 list 里最后一次 join - 逐段 += 会反复重拷整个字符串（O(N^2)）
+    parts: List[str] = []
+    async for delta in call_ai_api_stream(system_prompt, user_prompt, mode):
+        parts.append(delta)
+        yield b"data: " + _json_dumps({"delta": delta}) + b"\n\n"
+
+    completion = clean_completion("".join(parts))
+    if completion:
+        _cache_put(cache_key, completion)
+    yield b"data: [DONE]\n\n"
+
+
+@app.post("/v1/cache/clear")
+async def clear_cache():
+    """清空补全缓存（管理端点）"""
+    cleared = len(_completion_cache)
+    _completion_cache.clear()
+    return {"cleared": cleared}
+
+
 @app.post("/v1/completion", response_model=CompletionOutput)
-async def create_completion(input_data: CompletionInput):
+async def create_completion(input_data: CompletionInput, stream: bool = False):
     """
     AI 代码补全端点
+
+    ?stream=true 时以 SSE 流式返回增量（time-to-first-token 远低于整体生成时间），
+    否则保持原有的一次性 JSON 响应。
     """
     request_start = time.time()
-    print(f"\n{'='*50}")
-    print(f"[收到补全请求] {input_data.file_path}:{input_data.cursor_line}:{input_data.cursor_column}")
-    print(f"[内容预览] {input_data.content[:100]}...")
-    print(f"{'='*50}")
-
-    # 分割 PREFIX / SUFFIX
-    lines = input_data.content.split('\n')
-    cursor_line = min(input_data.cursor_line, len(lines) - 1)
-    cursor_col = input_data.cursor_column
+    logger.debug("[收到补全请求] %s:%s:%s", input_data.file_path, input_data.cursor_line, input_data.cursor_column)
+    logger.debug("[内容预览] %.100s...", input_data.content)
 
-    # 构建 PREFIX（光标前的所有内容）
-    prefix_lines = lines[:cursor_line]
-    if cursor_line < len(lines):
-        prefix_lines.append(lines[cursor_line][:cursor_col])
-    prefix = '\n'.join(prefix_lines)
-
-    # 构建 SUFFIX（光标后的所有内容）
-    suffix_lines = []
-    if cursor_line < len(lines):
-        suffix_lines.append(lines[cursor_line][cursor_col:])
-        suffix_lines.extend(lines[cursor_line + 1:])
-    suffix = '\n'.join(suffix_lines)
+    # 分割 PREFIX / SUFFIX（O(1) 切片，不拷贝整个文件）
+    cursor_line = input_data.cursor_line
+    cursor_col = input_data.cursor_column
+    prefix, suffix = _split_at_cursor_cached(input_data.content, cursor_line, cursor_col)
 
     # 获取语言
     language = get_language_from_path(input_data.file_path)
 
-    # 如果内容太少，不触发补全
-    if len(prefix.strip()) < 3:
+    # 如果内容太少、或语句刚结束（明显无需补全），不触发上游调用
+    if len(prefix.strip()) < 3 or (AGGRESSIVE_SKIP and _is_trivial_context(prefix)):
+        if stream:
+            return StreamingResponse(_sse_done(), media_type="text/event-stream")
         return CompletionOutput(
             completion="",
             finish_reason="skip",
@@ -318,28 +691,70 @@ async def create_completion(input_data: CompletionInput):
 
     # 智能检测：如果注释描述复杂结构，自动升级为 block 模式
     mode = input_data.mode
-    complex_keywords = ['链表', '树', '栈', '队列', '图', 'linked list', 'tree', 'stack',
-                        'queue', 'graph', 'struct', 'class', '实现', 'implement']
-    last_line = prefix.strip().split('\n')[-1].lower() if prefix.strip() else ""
-    if any(kw in last_line for kw in complex_keywords):
+    stripped_prefix = prefix.rstrip()
+    last_line = stripped_prefix[stripped_prefix.rfind('\n') + 1:]
+    if _COMPLEX_RE.search(last_line):
         mode = "block"
-        print(f"[Completion] 检测到复杂结构请求，升级为 block 模式")
+        logger.info("[Completion] 检测到复杂结构请求，升级为 block 模式")
 
-    # 构建 prompt
-    system_prompt, user_prompt = build_fim_prompt(prefix, suffix, language, mode)
+    # 裁剪上下文 - block 模式（复杂结构生成）保留全文
+    if mode != "block":
+        prefix, suffix = _trim_context(prefix, suffix)
 
-    # 调用 AI API
-    completion = await call_ai_api(system_prompt, user_prompt, mode)
+    cache_key = _cache_key(mode, language, prefix, suffix)
+
+    # SSE 流式路径：边生成边转发
+    if stream:
+        system_prompt, user_prompt = build_fim_prompt(prefix, suffix, language, mode)
+        return StreamingResponse(
+            _completion_event_stream(cache_key, system_prompt, user_prompt, mode),
+            media_type="text/event-stream",
+        )
+
+    # 查缓存 - 命中则直接返回，不碰上游 API
+    cached_completion = _cache_get(cache_key)
+    if cached_completion is not None:
+        latency_ms = (time.time() - request_start) * 1000
+        logger.info("[Completion] 缓存命中 (%.1fms)", latency_ms)
+        return CompletionOutput(
+            completion=cached_completion,
+            finish_reason="stop" if cached_completion else "empty",
+            model=get_current_model(mode),
+            latency_ms=latency_ms,
+            cached=True,
+        )
+
+    # 合并在途的相同请求
+    inflight_fut = _inflight.get(cache_key)
+    if inflight_fut is not None:
+        logger.debug("[Completion] 合并在途请求")
+        completion = await inflight_fut
+    else:
+        inflight_fut = asyncio.get_running_loop().create_future()
+        _inflight[cache_key] = inflight_fut
+        try:
+            # 构建 prompt 并调用 AI API
+            system_prompt, user_prompt = build_fim_prompt(prefix, suffix, language, mode)
+            completion = await call_ai_api(system_prompt, user_prompt, mode)
+            inflight_fut.set_result(completion)
+        except BaseException:
+            inflight_fut.cancel()
+            raise
+        finally:
+            _inflight.pop(cache_key, None)
 
     if completion is None:
         completion = ""
+    else:
+        # 只缓存成功的响应，避免把上游瞬时故障固化下来
+        _cache_put(cache_key, completion)
 
     # 不再截断多行 - 让前端决定如何显示
     # Cursor 风格：inline 也可以显示多行 ghost text
 
     latency_ms = (time.time() - request_start) * 1000
 
-    print(f"[Completion] {input_data.file_path}:{cursor_line}:{cursor_col} -> '{completion[:50]}...' ({latency_ms:.1f}ms)")
+    logger.info("[Completion] %s:%s:%s -> %.50r... (%.1fms)", input_data.file_path, cursor_line, cursor_col, completion, latency_ms)
 
     return CompletionOutput(
         completion=completion,
@@ -356,11 +771,41 @@ async def create_completion(input_data: CompletionInput):
 
 if __name__ == "__main__":
     import uvicorn
+
+    logging.basicConfig(
+        level=os.environ.get("MINDCODE_LOG_LEVEL", "INFO"),
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+
+    # uvloop (libuv) 事件循环 + httptools C 解析器，对这种纯 I/O 代理型服务提速明显；
+    # 未安装（如 Windows）时回退到标准实现
+    try:
+        import uvloop  # noqa: F401
+        loop_impl = "uvloop"
+    except ImportError:
+        loop_impl = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http_impl = "httptools"
+    except ImportError:
+        http_impl = "h11"
+
+    # 服务无共享状态，多 worker 进程可以线性利用多核吸收连接高峰；
+    # 也可以用 gunicorn -k uvicorn.workers.UvicornWorker -w N 部署
+    workers = int(os.environ.get("MINDCODE_WORKERS", os.cpu_count() or 1))
+
     print("=" * 60)
     print("  MindCode Completion Server v2.0 (AI Mode)")
     print(f"  [Claude 混合模式]")
     print(f"  Inline: {CLAUDE_MODEL_INLINE} (快速)")
     print(f"  Block:  {CLAUDE_MODEL_BLOCK} (智能)")
+    print(f"  loop={loop_impl} http={http_impl} workers={workers}")
     print("  http://localhost:8765")
     print("=" * 60)
-    uvicorn.run(app, host="0.0.0.0", port=8765)
+    if workers > 1:
+        # 多 worker 需要 import string，每个 worker 进程独立导入模块，
+        # 各自创建自己的 http 客户端和缓存
+        uvicorn.run("server:app", host="0.0.0.0", port=8765,
+                    workers=workers, loop=loop_impl, http=http_impl)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8765, loop=loop_impl, http=http_impl)
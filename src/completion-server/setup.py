@@ -0,0 +1,15 @@
+"""
+编译补全热路径（可选）：
+
+    pip install cython
+    python setup.py build_ext --inplace
+
+编译产物存在时 server.py 自动启用，否则回退到纯 Python 实现。
+"""
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="completion-fastpath",
+    ext_modules=cythonize("completion_fastpath.pyx", language_level="3"),
+)